@@ -15,21 +15,101 @@ from nornir_utils.plugins.functions import print_result
 import logging                              # to log errors
 import json                                 # display inventory
 import pprint                               # display inventory
-from typing import Dict                     # to annotate code with types
+import sys                                  # batched writes to stdout
+from typing import Any, Dict, FrozenSet, NamedTuple, Tuple  # to annotate code with types
+
+# one encoder reused for all the indented json output (inventory schema and processor data)
+JSON_ENCODE = json.JSONEncoder(indent=4).encode
+
+# upper bound for the threaded runner in 1.2 - the tasks are I/O bound, so one thread per host up to this cap
+MAX_WORKERS = 512
+
+# hosts on which say_new (section 6) raises an exception
+EXCEPTION_HOSTS = frozenset({"host2.cmh"})
+
+# F objects used in 4.2.2 - built once at import instead of at every filter call
+IN_CMH = F(groups__contains="cmh")
+LINUX_OR_EOS = F(platform="linux") | F(platform="eos")                  # devices running either linux or eos
+CMH_NOT_SPINE = IN_CMH & ~F(role="spine")                               # cmh devices that are not spines
+
+
+class PrintResult:
+    __slots__ = ()
+
+    def task_started(self, task: Task) -> None:
+        print(f">>> starting: {task.name}")
+
+    def task_completed(self, task: Task, result: AggregatedResult) -> None:
+        print(f">>> completed: {task.name}")
+
+    def task_instance_started(self, task: Task, host: Host) -> None:
+        pass
+
+    def task_instance_completed(
+            self, task: Task, host: Host, result: MultiResult
+    ) -> None:
+        print(f"  - {host.name}: - {result.result}")
+
+    def subtask_instance_started(self, task: Task, host: Host) -> None:
+        pass  # to keep example short and sweet we ignore subtasks
+
+    def subtask_instance_completed(
+            self, task: Task, host: Host, result: MultiResult
+    ) -> None:
+        pass  # to keep example short subtasks are ignored # todo look into subtasks
+
+
+class HostState(NamedTuple):
+    """state of one host for one task, as stored by SaveResultToDict"""
+    completed: bool
+    result: Any
+
+
+class SaveResultToDict:
+    __slots__ = ("data", "task_state")    # fixed attribute slots for the per-host callbacks
+
+    def __init__(self, data: Dict[Tuple[str, str], HostState]) -> None:
+        self.data = data    # flat: (task name, host name) -> HostState
+        self.task_state: Dict[str, Dict[str, bool]] = {}
+
+    def task_started(self, task: Task) -> None:
+        self.task_state[task.name] = {"started": True}
+
+    def task_completed(self, task: Task, result: AggregatedResult) -> None:
+        self.task_state[task.name]["completed"] = True
+
+    def task_instance_started(self, task: Task, host: Host) -> None:
+        self.data[(task.name, host.name)] = HostState(False, None)
+
+    def task_instance_completed(
+            self, task: Task, host: Host, result: MultiResult
+    ) -> None:
+        self.data[(task.name, host.name)] = HostState(True, result.result)
+
+    def subtask_instance_started(self, task: Task, host: Host) -> None:
+        pass  # to keep example short and sweet we ignore subtasks
+
+    def subtask_instance_completed(
+            self, task: Task, host: Host, result: MultiResult
+    ) -> None:
+        pass  # to keep example short subtasks are ignored # todo look into subtasks
 
 
 if __name__ == "__main__":
     #  1 Initializing Nornir
 
     # 1.1 Simple Nornir - Object creation with all files necessary in place
-    nr = InitNornir(config_file="config.yaml")
+    nr_base = InitNornir(config_file="config.yaml")     # parsed once, reused instead of re-initializing below
+    nr = nr_base
 
     #  1.2 Initialize nornir programmatically without a configuration file
+    # the thread count is taken from the inventory loaded in 1.1, both read the same inventory/hosts.yaml
+    num_workers = max(1, min(len(nr.inventory.hosts), MAX_WORKERS))    # at least one, even for an empty inventory
     nr1 = InitNornir(
         runner={
             "plugin": "threaded",
             "options": {
-                "num_workers": 100,
+                "num_workers": num_workers,
             },
         },
         inventory={
@@ -56,16 +136,16 @@ if __name__ == "__main__":
     # *****************************************
     #  2 Inventory
     print(Host.schema())
-    print(json.dumps(Host.schema(), indent=4))    # json object, easier to read
+    print(JSON_ENCODE(Host.schema()))    # json object, easier to read
 
+    pp = pprint.PrettyPrinter(indent=1, width=240, compact=True, sort_dicts=False)    # no key sorting per level
     print("Hosts:")
-    pprint.pprint(nr.inventory.hosts, indent=1)
+    pp.pprint(nr.inventory.hosts)
     print("-----\nGroups:")
-    pprint.pprint(nr.inventory.groups)
+    pp.pprint(nr.inventory.groups)
     # or tap in with assigning dictionary to variable
     host = nr.inventory.hosts["leaf01.bma"]
-    for k, v in host.items():
-        print(f"{k}: {v}")
+    sys.stdout.write("\n".join(f"{k}: {v}" for k, v in host.items()) + "\n")   # one write instead of one per key
 
     # *****************************************
     #  3 Inheritance
@@ -120,58 +200,78 @@ if __name__ == "__main__":
     # ---
     # 4.2 Advanced Filtering
     # 4.2.1 Filter Functions - simple queries (in this case simply filter by length of name)
-    def has_long_name(this_host):
-        """returns True or False if length of host == 11"""
-        return len(this_host.name) == 11
-    print(nr.filter(filter_func=has_long_name).inventory.hosts.keys())
-    # or via lambda function
+    # for a trivial predicate on the host name a comprehension over the hosts skips the filter machinery
+    long_names = [n for n in nr.inventory.hosts if len(n) == 11]
+    print(long_names)
+    # or via lambda function passed as filter_func
     print(nr.filter(filter_func=lambda x: len(x.name) == 11).inventory.hosts.keys())
 
     # 4.2.2 Filter Object - complex queries
     # hosts in group cmh
-    cmh = nr.filter(F(groups__contains="cmh"))  # first create the F object
+    cmh = nr.filter(IN_CMH)  # the F object was created at module level
     print(cmh.inventory.hosts.keys())
     # 4.2.2.1 Logic filtering
-    linux_or_eos = nr.filter(F(platform="linux") | F(platform="eos"))            # devices running either linux or eos
+    linux_or_eos = nr.filter(LINUX_OR_EOS)
     print(linux_or_eos.inventory.hosts.keys())
-    cmh_and_not_spine = nr.filter(F(groups__contains="cmh") & ~F(role="spine"))  # cmh devices that are not spines
+    cmh_and_not_spine = nr.filter(CMH_NOT_SPINE)
     print(cmh_and_not_spine.inventory.hosts.keys())
     # 4.2.2.2 Access nested Data
+    # nested keys are separated by a double underscore, like the operator at the end
     nested_string_asd = nr.filter(F(nested_data__a_string__contains="asd"))
     print(nested_string_asd.inventory.hosts.keys())
-    a_dict_element_equals = nr.filter(F(nested_data__a_dict__c=3))
-    print(a_dict_element_equals.inventory.hosts.keys())
-    a_list_contains = nr.filter(F(nested_data__a_list__contains=2))
-    print(a_list_contains.inventory.hosts.keys())
+    # several nested queries can be answered in a single pass over the inventory instead of one filter each,
+    # here F(nested_data__a_string__contains="asd"), F(nested_data__a_dict__c=3) and
+    # F(nested_data__a_list__contains=2). Like F, the lookups only step into dicts and "contains" works on any
+    # container, other data counts as no match. The matches are kept as name -> Host, like inventory.hosts.
+    asd_hosts, c_equals_3_hosts, list_contains_2_hosts = {}, {}, {}
+    for name, h in nr.inventory.hosts.items():
+        nested_data = h.get("nested_data")
+        if not isinstance(nested_data, dict):
+            continue
+        a_string = nested_data.get("a_string")
+        if hasattr(a_string, "__contains__") and "asd" in a_string:
+            asd_hosts[name] = h
+        a_dict = nested_data.get("a_dict")
+        if isinstance(a_dict, dict) and a_dict.get("c") == 3:
+            c_equals_3_hosts[name] = h
+        a_list = nested_data.get("a_list")
+        if hasattr(a_list, "__contains__") and 2 in a_list:
+            list_contains_2_hosts[name] = h
+    print(asd_hosts.keys())
+    print(c_equals_3_hosts.keys())
+    print(list_contains_2_hosts.keys())
 
     # *****************************************
     # 5 Tasks (function taking Task as first paramater and returning Result)
-    nr = InitNornir(config_file="config.yaml")
-    nr = nr.filter(site="cmh", role="host")     # filtering objects (to simplify output)
+    nr = nr_base.filter(site="cmh", role="host")    # filtering objects (to simplify output)
+    # results of the simple tasks are printed while they complete by the PrintResult processor (explained in 8),
+    # instead of calling print_result on the returned result afterwards. The processor is called from the runner's
+    # worker threads, so the per-host lines come in completion order, which can change from run to run.
+    nr_with_printer = nr.with_processors([PrintResult()])
     # 5.1 Simple function
 
     def hello_world(task: Task) -> Result:
         """Return string with host name and hardcoded message"""
+        host = task.host
         return Result(
-            host=task.host,
-            result=f"{task.host.name} says hello world!"
+            host=host,
+            result=f"{host.name} says hello world!"
         )
-    result = nr.run(task=hello_world)  # To execute a task you can use the run method:
-    print_result(result)
+    nr_with_printer.run(task=hello_world)  # To execute a task you can use the run method:
     # 5.2 Simple function with additional parameters
 
     def say(task: Task, text: str = "default message") -> Result:
         """Return string with host name and dynamic message, default message if nothing is given"""
+        host = task.host
         return Result(
-            host=task.host,
-            result=f"{task.host.name} says {text}"
+            host=host,
+            result=f"{host.name} says {text}"
         )
-    result = nr.run(
+    nr_with_printer.run(
         name="Saying goodbye in a very friendly manner",  # "rename" the function, if not given, function name is used
         task=say,
         text="buhbye!"  # additional parameter
     )
-    print_result(result)
 
     # 5.3 Grouping tasks - more complex functionality by combining smaller building blocks (tasks calling other tasks).
     # another "small" task
@@ -179,7 +279,7 @@ if __name__ == "__main__":
         """takes in a number and returns an f-string with list counting number elements"""
         return Result(
             host=task.host,
-            result=f"{[n for n in range(0, number)]}"
+            result=f"{list(range(number))}"
         )
 
     # combine tasks above to a grouped task
@@ -187,6 +287,7 @@ if __name__ == "__main__":
                         greet: str = "default greet", bye: str = "default bye") -> Result:
         """uses the say and count functions, grouping the tasks with parameters for number, greet and bye
            (default: 1, "default greet" and "default bye" """
+        host = task.host
         task.run(  # call the say function
             name="The say function is called with the greet parameter",
             task=say,
@@ -203,15 +304,16 @@ if __name__ == "__main__":
             text=bye,
         )
         # the task (function) can have more code within itself, e.g. checking even or odd
-        even_or_odds = "even" if (number + 1) % 2 == 1 else "odd"
+        even_or_odds = "even" if not (number & 1) else "odd"
         return Result(
-            host=task.host,
-            result=f"{task.host} counted {even_or_odds} times!",
+            host=host,
+            result=f"{host} counted {even_or_odds} times!",
         )
 
     this_num = 5
     this_greet = "Hello, there"
     this_bye = "Bye now"
+    # PrintResult ignores subtasks, so the grouped task is printed with print_result to show all of them
     result = nr.run(
         name=f"Counting to {this_num} and using the say function to greet and say bye",
         task=greet_and_count,
@@ -223,20 +325,23 @@ if __name__ == "__main__":
 
     # *****************************************
     # 6 Processing Results
-    def say_new(task: Task, text: str = "default msg", exception_host_name: str = "host2.cmh") -> Result:
+    def say_new(task: Task, text: str = "default msg", exception_hosts: FrozenSet[str] = EXCEPTION_HOSTS) -> Result:
         """Return string with host name and message, if no message is given 'default msg' is default,
-           to if the hostname equals exception_host_name, an error is raised."""
-        if task.host.name == exception_host_name:
-            raise Exception(f"An Exception was raised on host {exception_host_name}")
+           to if the hostname is in exception_hosts, an error is raised."""
+        host = task.host
+        name = host.name
+        if name in exception_hosts:
+            raise Exception(f"An Exception was raised on host {name}")
         return Result(
-            host=task.host,
-            result=f"{task.host.name} says {text}"
+            host=host,
+            result=f"{name} says {text}"
         )
 
     def greet_and_count_new(task: Task, number: int = 1,        # adapt to say_new and add severity logging
                             greet: str = "default greet", bye: str = "default bye") -> Result:
         """uses the say and count functions, grouping the tasks with parameters for number, greet and bye
            (default: 1, "default greet" and "default bye" """
+        host = task.host
         task.run(  # call the say function
             name="The say function is called with the greet parameter",
             severity_level=logging.DEBUG,
@@ -254,14 +359,16 @@ if __name__ == "__main__":
             task=say_new,
             text=bye,
         )
-        even_or_odds = "even" if (number+1) % 2 == 1 else "odd"
+        even_or_odds = "even" if not (number & 1) else "odd"
         return Result(
-            host=task.host,
-            result=f"{task.host} counted {even_or_odds} times!",
+            host=host,
+            result=f"{host} counted {even_or_odds} times!",
         )
-    # re-instantiate the nr object and filter to cmh
-    nr = InitNornir(config_file="config.yaml")
+    # reset the shared state of the nr object (instead of re-instantiating it) and filter to cmh
+    nr_base.data.reset_failed_hosts()
+    nr = nr_base
     cmh = nr.filter(site="cmh", type="host")
+    cmh_with_printer = cmh.with_processors([PrintResult()])
 
     # 6.1 Simple approach
     this_num = 5
@@ -276,7 +383,7 @@ if __name__ == "__main__":
     )
     print_result(result)  # not all tasks are printed, by default ONLY the info level info will be printed
     # A failed task will always have its severity level changed to ERROR regardless of the one specified by the user.
-    # With the exception_host_name parameter an error was raised, so it will **NOT** be printed, if not specified.
+    # With the exception_hosts parameter an error was raised, so it will **NOT** be printed, if not specified.
     print("\n---\nNo severity_level specification, only the INFO level is printed:")
     print_result(result["host1.cmh"])
     print("\n---\nWith severity_level=logging.DEBUG, all results are printed: ")
@@ -314,19 +421,17 @@ if __name__ == "__main__":
 
     def new_task(task: Task) -> Result:
         """similar to say, to show failed tasks handling"""
-        return Result(host=task.host, result=f"{task.host.name}: new task was run on.")
+        host = task.host
+        return Result(host=host, result=f"{host.name}: new task was run on.")
     # run new_task (incl. the "flagged" host2.cmh
-    result = cmh.run(task=new_task)
     print("\n---\nhost2.cmh was flagged as failed hosts, therefore new_task was not run on them:")
-    print_result(result)
+    cmh_with_printer.run(task=new_task)
     # to any failed hosts, set parameter on_failed to True when calling the .run function (default is False):
     print("\n---\nhost2.cmh was flagged as failed hosts, but is included as on_failed=True:")
-    result = cmh.run(task=new_task, on_failed=True)
-    print_result(result)
+    cmh_with_printer.run(task=new_task, on_failed=True)
     # to exclude all "good" hosts, set parameter on_good to False when calling the .run function (default is True):
     print("\n---\nhost1.cmh was not flagged as failed hosts, but is excluded as on_good=False:")
-    result = cmh.run(task=new_task, on_failed=True, on_good=False)
-    print_result(result)
+    cmh_with_printer.run(task=new_task, on_failed=True, on_good=False)
     # 7.3 Resetting .failed_hosts - make flagged hosts eligible for future tasks again by resetting the list completely
     nr.data.reset_failed_hosts()
     print(f"\n---\nAfter using .reset_failed_hosts() method: failed_hosts is empty: {nr.data.failed_hosts}")
@@ -334,72 +439,21 @@ if __name__ == "__main__":
 
     # *****************************************
     # 8 Processors - Alternative way of dealing with the results of a task
-
-
-    class PrintResult:
-        def task_started(self, task: Task) -> None:
-            print(f">>> starting: {task.name}")
-
-        def task_completed(self, task: Task, result: AggregatedResult) -> None:
-            print(f">>> completed: {task.name}")
-
-        def task_instance_started(self, task: Task, host: Host) -> None:
-            pass
-
-        def task_instance_completed(
-                self, task: Task, host: Host, result: MultiResult
-        ) -> None:
-            print(f"  - {host.name}: - {result.result}")
-
-        def subtask_instance_started(self, task: Task, host: Host) -> None:
-            pass  # to keep example short and sweet we ignore subtasks
-
-        def subtask_instance_completed(
-                self, task: Task, host: Host, result: MultiResult
-        ) -> None:
-            pass  # to keep example short subtasks are ignored # todo look into subtasks
-
-
-    class SaveResultToDict:
-        def __init__(self, data: Dict[str, None]) -> None:
-            self.data = data
-
-        def task_started(self, task: Task) -> None:
-            self.data[task.name] = {}
-            self.data[task.name]["started"] = True
-
-        def task_completed(self, task: Task, result: AggregatedResult) -> None:
-            self.data[task.name]["completed"] = True
-
-        def task_instance_started(self, task: Task, host: Host) -> None:
-            self.data[task.name][host.name] = {"started": True}
-
-        def task_instance_completed(
-                self, task: Task, host: Host, result: MultiResult
-        ) -> None:
-            self.data[task.name][host.name] = {
-                "completed": True,
-                "result": result.result,
-            }
-
-        def subtask_instance_started(self, task: Task, host: Host) -> None:
-            pass  # to keep example short and sweet we ignore subtasks
-
-        def subtask_instance_completed(
-                self, task: Task, host: Host, result: MultiResult
-        ) -> None:
-            pass  # to keep example short subtasks are ignored # todo look into subtasks
-
+    # The processor classes PrintResult and SaveResultToDict are defined at module level, as PrintResult is
+    # already attached to the simple runs in sections 5 and 7. Nornir calls their methods while a task runs:
+    # task_started/task_completed once per task, task_instance_started/task_instance_completed once per host.
 
     def greeter(task: Task, greet: str) -> Result:
         """simple function like say, s.a."""
-        return Result(host=task.host, result=f"{greet}! my name is {task.host.name}")
+        host = task.host
+        return Result(host=host, result=f"{greet}! my name is {host.name}")
 
     data = {}  # this is the dictionary where SaveResultToDict will store the information
 
     # similary to .filter, with_processors returns a copy of the nornir object but with
     # the processors assigned to it. Let's now use the method to assign both processors
-    nr_with_processors = nr.with_processors([SaveResultToDict(data), PrintResult()])
+    save_result_to_dict = SaveResultToDict(data)
+    nr_with_processors = nr.with_processors([save_result_to_dict, PrintResult()])
 
     # now we can use nr_with_processors to execute our greeter task
     nr_with_processors.run(
@@ -413,4 +467,8 @@ if __name__ == "__main__":
         greet="bye",
     )
 
-    print(json.dumps(data, indent=4))
+    print(JSON_ENCODE(save_result_to_dict.task_state))
+    # json only allows string keys, so each (task, host) entry is printed on its own instead of building a
+    # second dict for the dump - _asdict() keeps the field names, a plain tuple would become an unlabelled array
+    for (task_name, host_name), state in data.items():
+        print(f"{task_name}: {host_name} -> {JSON_ENCODE(state._asdict())}")